@@ -31,14 +31,6 @@ from tensorflow_probability.python.internal import test_util
 tfpk = tfp.math.psd_kernels
 
 
-def skip_if_no_xla(skip_test_fn):
-  try:
-    tf.function(lambda: tf.constant(0), experimental_compile=True)()
-  except tf.errors.UnimplementedError as e:
-    if 'Could not find compiler' in str(e):
-      skip_test_fn('XLA not available')
-
-
 @test_util.test_all_tf_execution_regimes
 class LinearOperatorPSDKernelTest(test_util.TestCase):
   """Tests for tfp.experimental.linalg.LinearOperatorPSDKernel."""
@@ -80,7 +72,7 @@ class LinearOperatorPSDKernelTest(test_util.TestCase):
     self.assertAllClose(expected, actual)
 
   def test_diag_part_xla(self):
-    skip_if_no_xla(self.skipTest)
+    test_util.skip_if_no_xla(self.skipTest)
     if not tf.executing_eagerly(): return  # experimental_compile is eager-only.
     kernel = tfpk.ExponentiatedQuadratic()
     x1 = tf.random.normal([7, 3, 5, 2])  # square matrix 5x5
@@ -218,7 +210,7 @@ class LinearOperatorPSDKernelTest(test_util.TestCase):
       self.assertAllClose(expected, actual)
 
   def test_matmul_xla(self):
-    skip_if_no_xla(self.skipTest)
+    test_util.skip_if_no_xla(self.skipTest)
     if not tf.executing_eagerly(): return  # experimental_compile is eager-only.
     kernel = tfpk.ExponentiatedQuadratic()
     x1 = tf.random.normal([5, 3])
@@ -238,7 +230,7 @@ class LinearOperatorPSDKernelTest(test_util.TestCase):
     self.assertAllClose(expected, actual)
 
   def test_matmul_grad_xla(self):
-    skip_if_no_xla(self.skipTest)
+    test_util.skip_if_no_xla(self.skipTest)
     if not tf.executing_eagerly(): return  # experimental_compile is eager-only.
     kernel = tfpk.ExponentiatedQuadratic()
     x1 = tf.random.normal([5, 3])
@@ -271,7 +263,7 @@ class LinearOperatorPSDKernelTest(test_util.TestCase):
       self.assertAllClose(expected, actual)
 
   def test_matmul_grad_xla_kernelparams(self):
-    skip_if_no_xla(self.skipTest)
+    test_util.skip_if_no_xla(self.skipTest)
     if not tf.executing_eagerly(): return  # experimental_compile is eager-only.
     feature_dim = 3
 
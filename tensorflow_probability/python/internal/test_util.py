@@ -40,6 +40,7 @@ __all__ = [
     'numpy_disable_gradient_test',
     'jax_disable_variable_test',
     'jax_disable_test_missing_functionality',
+    'skip_if_no_xla',
     'test_all_tf_execution_regimes',
     'test_graph_and_eager_modes',
     'test_seed',
@@ -377,6 +378,19 @@ def jax_disable_test_missing_functionality(issue_link):
   return f
 
 
+def skip_if_no_xla(skip_test_fn):
+  """Calls `skip_test_fn` if this TF build cannot compile with XLA.
+
+  Args:
+    skip_test_fn: Callable taking a reason string, e.g., `self.skipTest`.
+  """
+  try:
+    tf.function(lambda: tf.constant(0), experimental_compile=True)()
+  except tf.errors.UnimplementedError as e:
+    if 'Could not find compiler' in str(e):
+      skip_test_fn('XLA not available')
+
+
 def test_seed(hardcoded_seed=None, set_eager_seed=True):
   """Returns a command-line-controllable PRNG seed for unit tests.
 
@@ -19,10 +19,11 @@ from __future__ import division
 from __future__ import print_function
 
 import functools
+
+from absl.testing import parameterized
 import numpy as np
 from scipy.stats import special_ortho_group
 
-import tensorflow.compat.v1 as tf1
 import tensorflow.compat.v2 as tf
 import tensorflow_probability as tfp
 
@@ -37,78 +38,126 @@ def _make_val_and_grad_fn(value_fn):
 
 
 def _norm(x):
-  return np.linalg.norm(x, np.inf)
+  return np.max(np.abs(x))
 
 
-@test_util.test_all_tf_execution_regimes
-class LBfgsTest(test_util.TestCase):
-  """Tests for LBFGS optimization algorithm."""
+def _himmelblau(coord):
+  """The value and gradient of Himmelblau's function.
 
-  def test_quadratic_bowl_2d(self):
-    """Can minimize a two dimensional quadratic function."""
-    minimum = np.array([1.0, 1.0])
-    scales = np.array([2.0, 3.0])
+  Args:
+    coord: Real `Tensor` of shape [..., 2]. The coordinates of the points at
+      which to evaluate the function.
 
-    @_make_val_and_grad_fn
-    def quadratic(x):
-      return tf.reduce_sum(input_tensor=scales * (x - minimum)**2)
+  Returns:
+    fv: `Tensor` of shape [...] containing the function values.
+    grad: `Tensor` of shape [..., 2] containing the gradients with respect to
+      `x` and `y`.
+  """
+  x, y = coord[..., 0], coord[..., 1]
+  a = x * x + y - 11
+  b = x + y * y - 7
+  fv = a * a + b * b
+  dfx = 4 * x * a + 2 * b
+  dfy = 2 * a + 4 * y * b
+  return fv, tf.stack([dfx, dfy], axis=-1)
 
-    start = tf.constant([0.6, 0.8])
-    results = self.evaluate(tfp.optimizer.lbfgs_minimize(
-        quadratic, initial_position=start, tolerance=1e-8))
-    self.assertTrue(results.converged)
-    self.assertTrue(_norm(results.objective_gradient) <= 1e-8)
-    self.assertArrayNear(results.position, minimum, 1e-5)
 
-  def test_high_dims_quadratic_bowl_trivial(self):
-    """Can minimize a high-dimensional trivial bowl (sphere)."""
-    ndims = 100
-    minimum = np.ones([ndims], dtype='float64')
-    scales = np.ones([ndims], dtype='float64')
+def _random_bowl(seed, dim):
+  """Returns the minimum and scales of a random diagonal quadratic bowl."""
+  rng = np.random.RandomState(seed)
+  minimum = rng.randn(dim)
+  scales = np.exp(rng.randn(dim))
+  return minimum, scales
 
-    @_make_val_and_grad_fn
-    def quadratic(x):
-      return tf.reduce_sum(input_tensor=scales * (x - minimum)**2)
 
-    start = np.zeros([ndims], dtype='float64')
-    results = self.evaluate(tfp.optimizer.lbfgs_minimize(
-        quadratic, initial_position=start, tolerance=1e-8))
-    self.assertTrue(results.converged)
-    self.assertEqual(results.num_iterations, 1)  # Solved by first line search.
-    self.assertTrue(_norm(results.objective_gradient) <= 1e-8)
-    self.assertArrayNear(results.position, minimum, 1e-5)
+_BOWL_40D_MINIMUM, _BOWL_40D_SCALES = _random_bowl(14159, 40)
+
+
+_ROTATION_CACHE = {}
+
+
+def _rotation(seed, dim):
+  """Returns a cached random rotation matrix of shape [dim, dim]."""
+  key = (seed, dim)
+  if key not in _ROTATION_CACHE:
+    _ROTATION_CACHE[key] = special_ortho_group.rvs(
+        dim, random_state=np.random.RandomState(seed))
+  return _ROTATION_CACHE[key]
+
+
+_DATA_FITTING_CACHE = {}
+
+
+def _data_fitting_dataset(seed):
+  """Returns cached binary covariates `x` and geometric responses `y`."""
+  if seed not in _DATA_FITTING_CACHE:
+    n, dim = 100, 30
+    rng = np.random.RandomState(seed)
+    x = rng.choice([0, 1], size=[dim, n])
+    s = 0.01 * np.sum(x, 0)
+    p = 1. / (1 + np.exp(-s))
+    y = rng.geometric(p)
+    _DATA_FITTING_CACHE[seed] = (x, y)
+  return _DATA_FITTING_CACHE[seed]
+
 
-  def test_quadratic_bowl_40d(self):
-    """Can minimize a high-dimensional quadratic function."""
-    dim = 40
-    np.random.seed(14159)
-    minimum = np.random.randn(dim)
-    scales = np.exp(np.random.randn(dim))
+@test_util.test_all_tf_execution_regimes
+class LBfgsTest(test_util.TestCase):
+  """Tests for LBFGS optimization algorithm."""
+
+  @parameterized.named_parameters(
+      dict(testcase_name='2d',
+           minimum=np.array([1.0, 1.0]),
+           scales=np.array([2.0, 3.0]),
+           start=np.array([0.6, 0.8]),
+           tolerance=1e-8),
+      dict(testcase_name='40d',
+           minimum=_BOWL_40D_MINIMUM,
+           scales=_BOWL_40D_SCALES,
+           start=np.ones([40]),
+           tolerance=1e-8),
+      # The sphere is well conditioned, so single precision is enough here.
+      dict(testcase_name='100d_sphere',
+           minimum=np.ones([100], dtype='float32'),
+           scales=np.ones([100], dtype='float32'),
+           start=np.zeros([100], dtype='float32'),
+           tolerance=1e-5,
+           num_iterations=1))  # Solved by first line search.
+  def test_quadratic_bowl(self, minimum, scales, start, tolerance,
+                          num_iterations=None):
+    """Can minimize a quadratic function with a diagonal Hessian."""
+    scales_t = tf.constant(scales)
+    minimum_t = tf.constant(minimum)
 
     @_make_val_and_grad_fn
     def quadratic(x):
-      return tf.reduce_sum(input_tensor=scales * (x - minimum)**2)
+      return tf.einsum('i,i->', scales_t,
+                       tf.math.squared_difference(x, minimum_t))
 
-    start = tf.ones_like(minimum)
+    start = tf.constant(start)
     results = self.evaluate(tfp.optimizer.lbfgs_minimize(
-        quadratic, initial_position=start, tolerance=1e-8))
+        quadratic, initial_position=start, tolerance=tolerance))
     self.assertTrue(results.converged)
-    self.assertTrue(_norm(results.objective_gradient) <= 1e-8)
-    self.assertArrayNear(results.position, minimum, 1e-5)
+    if num_iterations is not None:
+      self.assertEqual(results.num_iterations, num_iterations)
+    self.assertTrue(_norm(results.objective_gradient) <= tolerance)
+    self.assertAllClose(results.position, minimum, atol=1e-5, rtol=0)
 
   def test_quadratic_with_skew(self):
     """Can minimize a general quadratic function."""
     dim = 50
-    np.random.seed(26535)
-    minimum = np.random.randn(dim)
-    principal_values = np.diag(np.exp(np.random.randn(dim)))
-    rotation = special_ortho_group.rvs(dim)
+    rng = np.random.RandomState(26535)
+    minimum = rng.randn(dim)
+    principal_values = np.diag(np.exp(rng.randn(dim)))
+    rotation = _rotation(31415, dim)
     hessian = np.dot(np.transpose(rotation), np.dot(principal_values, rotation))
+    hessian_t = tf.constant(hessian)
+    minimum_t = tf.constant(minimum)
 
     @_make_val_and_grad_fn
     def quadratic(x):
-      y = x - minimum
-      yp = tf.tensordot(hessian, y, axes=[1, 0])
+      y = x - minimum_t
+      yp = tf.linalg.matvec(hessian_t, y)
       return tf.reduce_sum(input_tensor=y * yp) / 2
 
     start = tf.ones_like(minimum)
@@ -116,20 +165,22 @@ class LBfgsTest(test_util.TestCase):
         quadratic, initial_position=start, tolerance=1e-8))
     self.assertTrue(results.converged)
     self.assertTrue(_norm(results.objective_gradient) <= 1e-8)
-    self.assertArrayNear(results.position, minimum, 1e-5)
+    self.assertAllClose(results.position, minimum, atol=1e-5, rtol=0)
 
   def test_quadratic_with_strong_skew(self):
     """Can minimize a strongly skewed quadratic function."""
-    np.random.seed(89793)
-    minimum = np.random.randn(3)
+    rng = np.random.RandomState(89793)
+    minimum = rng.randn(3)
     principal_values = np.diag(np.array([0.1, 2.0, 50.0]))
-    rotation = special_ortho_group.rvs(3)
+    rotation = _rotation(27182, 3)
     hessian = np.dot(np.transpose(rotation), np.dot(principal_values, rotation))
+    hessian_t = tf.constant(hessian)
+    minimum_t = tf.constant(minimum)
 
     @_make_val_and_grad_fn
     def quadratic(x):
-      y = x - minimum
-      yp = tf.tensordot(hessian, y, axes=[1, 0])
+      y = x - minimum_t
+      yp = tf.linalg.matvec(hessian_t, y)
       return tf.reduce_sum(input_tensor=y * yp) / 2
 
     start = tf.ones_like(minimum)
@@ -137,7 +188,7 @@ class LBfgsTest(test_util.TestCase):
         quadratic, initial_position=start, tolerance=1e-8))
     self.assertTrue(results.converged)
     self.assertTrue(_norm(results.objective_gradient) <= 1e-8)
-    self.assertArrayNear(results.position, minimum, 1e-5)
+    self.assertAllClose(results.position, minimum, atol=1e-5, rtol=0)
 
   def test_rosenbrock_2d(self):
     """Tests L-BFGS on the Rosenbrock function.
@@ -172,7 +223,8 @@ class LBfgsTest(test_util.TestCase):
         rosenbrock, initial_position=start, tolerance=1e-5))
     self.assertTrue(results.converged)
     self.assertTrue(_norm(results.objective_gradient) <= 1e-5)
-    self.assertArrayNear(results.position, np.array([1.0, 1.0]), 1e-5)
+    self.assertAllClose(results.position, np.array([1.0, 1.0]),
+                        atol=1e-5, rtol=0)
 
   def test_himmelblau(self):
     """Tests minimization on the Himmelblau's function.
@@ -190,11 +242,6 @@ class LBfgsTest(test_util.TestCase):
     However, all four can be easily found in `test_himmelblau_batch_all` below
     with the help of batching.
     """
-    @_make_val_and_grad_fn
-    def himmelblau(coord):
-      x, y = coord[0], coord[1]
-      return (x * x + y - 11) ** 2 + (x + y * y - 7) ** 2
-
     starts_and_targets = [
         # Start Point, Target Minimum, Num evaluations expected.
         [(1, 1), (3, 2), 31],
@@ -204,18 +251,25 @@ class LBfgsTest(test_util.TestCase):
     for start, expected_minima, expected_evals in starts_and_targets:
       start = tf.constant(start, dtype=dtype)
       results = self.evaluate(tfp.optimizer.lbfgs_minimize(
-          himmelblau, initial_position=start, tolerance=1e-8))
+          _himmelblau, initial_position=start, tolerance=1e-8))
       self.assertTrue(results.converged)
-      self.assertArrayNear(results.position,
-                           np.array(expected_minima, dtype=dtype),
-                           1e-5)
+      self.assertAllClose(results.position,
+                          np.array(expected_minima, dtype=dtype),
+                          atol=1e-5, rtol=0)
       self.assertEqual(results.num_objective_evaluations, expected_evals)
 
-  def test_himmelblau_batch_all(self):
-    @_make_val_and_grad_fn
-    def himmelblau(coord):
-      x, y = coord[..., 0], coord[..., 1]
-      return (x * x + y - 11) ** 2 + (x + y * y - 7) ** 2
+  @parameterized.named_parameters(
+      dict(testcase_name='uncompiled', compile_objective=False),
+      dict(testcase_name='xla', compile_objective=True))
+  def test_himmelblau_batch_all(self, compile_objective):
+    himmelblau = _himmelblau
+    if compile_objective:
+      if (not tf.executing_eagerly() or
+          tf.config.experimental_functions_run_eagerly()):
+        self.skipTest('experimental_compile needs eager mode with tf.function.')
+      test_util.skip_if_no_xla(self.skipTest)
+      himmelblau = tf.function(
+          _himmelblau, autograph=False, experimental_compile=True)
 
     dtype = 'float64'
     starts = tf.constant([[1, 1],
@@ -234,16 +288,11 @@ class LBfgsTest(test_util.TestCase):
     self.assertTrue(np.all(batch_results.converged))  # All converged.
 
     # All converged points are near expected minima.
-    for actual, expected in zip(batch_results.position, expected_minima):
-      self.assertArrayNear(actual, expected, 1e-5)
+    self.assertAllClose(batch_results.position, expected_minima,
+                        atol=1e-5, rtol=0)
     self.assertEqual(batch_results.num_objective_evaluations, 36)
 
   def test_himmelblau_batch_any(self):
-    @_make_val_and_grad_fn
-    def himmelblau(coord):
-      x, y = coord[..., 0], coord[..., 1]
-      return (x * x + y - 11) ** 2 + (x + y * y - 7) ** 2
-
     dtype = 'float64'
     starts = tf.constant([[1, 1],
                           [-2, 2],
@@ -257,7 +306,7 @@ class LBfgsTest(test_util.TestCase):
     # Run with `converged_any` stopping condition, to stop as soon as any of
     # the batch members have converged.
     batch_results = self.evaluate(tfp.optimizer.lbfgs_minimize(
-        himmelblau, initial_position=starts,
+        _himmelblau, initial_position=starts,
         stopping_condition=tfp.optimizer.converged_any, tolerance=1e-8))
 
     self.assertFalse(np.any(batch_results.failed))  # None have failed.
@@ -265,37 +314,27 @@ class LBfgsTest(test_util.TestCase):
     self.assertFalse(np.all(batch_results.converged))  # But not all did.
 
     # Converged points are near expected minima.
-    for actual, expected in zip(batch_results.position[batch_results.converged],
-                                expected_minima[batch_results.converged]):
-      self.assertArrayNear(actual, expected, 1e-5)
+    mask = batch_results.converged
+    self.assertAllClose(batch_results.position[mask], expected_minima[mask],
+                        atol=1e-5, rtol=0)
     self.assertEqual(batch_results.num_objective_evaluations, 28)
 
   def test_data_fitting(self):
     """Tests MLE estimation for a simple geometric GLM."""
-    n, dim = 100, 30
     dtype = tf.float64
-    np.random.seed(234095)
-    x = np.random.choice([0, 1], size=[dim, n])
-    s = 0.01 * np.sum(x, 0)
-    p = 1. / (1 + np.exp(-s))
-    y = np.random.geometric(p)
+    x, y = _data_fitting_dataset(seed=234095)
+    dim = x.shape[0]
     x_data = tf.convert_to_tensor(value=x, dtype=dtype)
-    y_data = tf.expand_dims(tf.convert_to_tensor(value=y, dtype=dtype), -1)
+    y_data = tf.convert_to_tensor(value=y, dtype=dtype)
 
     @_make_val_and_grad_fn
     def neg_log_likelihood(state):
-      state_ext = tf.expand_dims(state, 0)
-      linear_part = tf.matmul(state_ext, x_data)
-      linear_part_ex = tf.stack([tf.zeros_like(linear_part),
-                                 linear_part], axis=0)
-      term1 = tf.squeeze(
-          tf.matmul(
-              tf.reduce_logsumexp(input_tensor=linear_part_ex, axis=0), y_data),
-          -1)
-      term2 = (
-          0.5 * tf.reduce_sum(input_tensor=state_ext * state_ext, axis=-1) -
-          tf.reduce_sum(input_tensor=linear_part, axis=-1))
-      return  tf.squeeze(term1 + term2)
+      linear_part = tf.linalg.matvec(x_data, state, transpose_a=True)
+      term1 = tf.reduce_sum(
+          input_tensor=tf.math.softplus(linear_part) * y_data)
+      term2 = (0.5 * tf.reduce_sum(input_tensor=state * state) -
+               tf.reduce_sum(input_tensor=linear_part))
+      return term1 + term2
 
     start = tf.ones(shape=[dim], dtype=dtype)
 
@@ -306,6 +345,8 @@ class LBfgsTest(test_util.TestCase):
   def test_determinism(self):
     """Tests that the results are determinsitic."""
     dim = 25
+    two_pi = tf.constant(2 * np.pi, dtype=tf.float64)
+    offset = 10.0 * dim
 
     @_make_val_and_grad_fn
     def rastrigin(x):
@@ -327,30 +368,31 @@ class LBfgsTest(test_util.TestCase):
           gradient: A `Tensor` of shape [2] containing the gradient of the
             function along the two axes.
       """
-      return tf.reduce_sum(input_tensor=x**2 -
-                           10.0 * tf.cos(2 * np.pi * x)) + 10.0 * dim
+      return tf.reduce_sum(
+          input_tensor=x * x - 10.0 * tf.cos(two_pi * x)) + offset
 
-    start_position = np.random.rand(dim) * 2.0 * 5.12 - 5.12
+    rng = np.random.RandomState(71828)
+    start_position = rng.rand(dim) * 2.0 * 5.12 - 5.12
 
     def get_results():
-      start = tf.constant(start_position)
+      start = tf.constant(start_position, dtype=tf.float64)
       return self.evaluate(tfp.optimizer.lbfgs_minimize(
           rastrigin, initial_position=start, tolerance=1e-5))
 
     res1, res2 = get_results(), get_results()
 
+    def flat_state(res):
+      return np.concatenate([res.position,
+                             res.objective_gradient,
+                             res.position_deltas.ravel(),
+                             res.gradient_deltas.ravel()])
+
     self.assertTrue(res1.converged)
-    self.assertEqual(res1.converged, res2.converged)
-    self.assertEqual(res1.failed, res2.failed)
-    self.assertEqual(res1.num_objective_evaluations,
-                     res2.num_objective_evaluations)
-    self.assertArrayNear(res1.position, res2.position, 1e-5)
+    self.assertAllEqual(
+        [res1.converged, res1.failed, res1.num_objective_evaluations],
+        [res2.converged, res2.failed, res2.num_objective_evaluations])
     self.assertAlmostEqual(res1.objective_value, res2.objective_value)
-    self.assertArrayNear(res1.objective_gradient, res2.objective_gradient, 1e-5)
-    self.assertArrayNear(res1.position_deltas.reshape([-1]),
-                         res2.position_deltas.reshape([-1]), 1e-5)
-    self.assertArrayNear(res1.gradient_deltas.reshape([-1]),
-                         res2.gradient_deltas.reshape([-1]), 1e-5)
+    self.assertAllClose(flat_state(res1), flat_state(res2), atol=1e-5, rtol=0)
 
   def test_dynamic_shapes(self):
     """Can build an lbfgs_op with dynamic shapes in graph mode."""
@@ -358,24 +400,31 @@ class LBfgsTest(test_util.TestCase):
     ndims = 60
     minimum = np.ones([ndims], dtype='float64')
     scales = np.arange(ndims, dtype='float64') + minimum
+    scales_t = tf.constant(scales)
+    minimum_t = tf.constant(minimum)
 
     @_make_val_and_grad_fn
     def quadratic(x):
-      return tf.reduce_sum(input_tensor=scales * (x - minimum)**2)
+      return tf.reduce_sum(
+          input_tensor=scales_t * tf.math.squared_difference(x, minimum_t))
 
     # Test with a vector of unknown dimension, and a fully unknown shape.
     for shape in ([None], None):
-      start = tf1.placeholder(tf.float32, shape=shape)
-      lbfgs_op = tfp.optimizer.lbfgs_minimize(
-          quadratic, initial_position=start, tolerance=1e-8)
-      self.assertFalse(lbfgs_op.position.shape.is_fully_defined())
+      @tf.function(
+          autograph=False,
+          input_signature=[tf.TensorSpec(shape=shape, dtype=tf.float64)])
+      def lbfgs_fn(start):
+        return tfp.optimizer.lbfgs_minimize(
+            quadratic, initial_position=start, tolerance=1e-8)
 
       start_value = np.arange(ndims, 0, -1, dtype='float64')
-      with self.cached_session() as session:
-        results = session.run(lbfgs_op, feed_dict={start: start_value})
+      lbfgs_op = lbfgs_fn(tf.constant(start_value))
+      self.assertFalse(lbfgs_op.position.shape.is_fully_defined())
+
+      results = self.evaluate(lbfgs_op)
       self.assertTrue(results.converged)
       self.assertTrue(_norm(results.objective_gradient) <= 1e-8)
-      self.assertArrayNear(results.position, minimum, 1e-5)
+      self.assertAllClose(results.position, minimum, atol=1e-5, rtol=0)
 
 
 if __name__ == '__main__':